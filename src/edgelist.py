@@ -8,8 +8,8 @@ This file takes in an edgelist graph and processes it using NetworkX.
 
 """
 import sys
+import argparse
 import networkx as nx
-import matplotlib.pyplot as plt
 import random
 
 def main(argv):
@@ -17,13 +17,22 @@ def main(argv):
     main:
     The main function calls all helper methods and runs the program.
     """
+    parser = argparse.ArgumentParser(
+                    prog='Edgelist Generator',
+                    description='Generates the example DFG and writes it to test.edgelist.')
+    parser.add_argument('--draw', action='store_true', help="Draw the generated DFG with matplotlib.")
+    args = parser.parse_args(argv)
+
     graph = write_edgelist()
     nx.write_edgelist(graph, "./test.edgelist")
 
     print(list(graph.nodes(data=True)))
     
-    nx.draw(graph)
-    plt.show()
+    # matplotlib is slow to import, so only pay for it when drawing
+    if args.draw:
+        import matplotlib.pyplot as plt
+        nx.draw(graph)
+        plt.show()
 
 
 def write_edgelist():
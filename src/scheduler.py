@@ -13,9 +13,24 @@ Last updated: 5/3/2023
 import sys
 import argparse
 import os
-import networkx as nx
+import subprocess
+import shutil
+import ast
+import re
+import mmap
+import functools
+from collections import defaultdict
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from tabulate import tabulate
 
+# glpsol output lines, matched over the whole output text in one pass
+# ex. "Objective:  obj = 12 (MINimum)" and "     1 a1           *              1             0"
+GLPSOL_OBJ_RE = re.compile(r'^Objective:[ \t]+\S+[ \t]+\S+[ \t]+(\S+)', re.M)
+GLPSOL_INT_COL_RE = re.compile(r'^[ \t]*\d+[ \t]+(\S+)[ \t]+\*[ \t]+(\S+)[ \t]+\S+[ \t]*$', re.M)
+GLPSOL_STATUS_RE = re.compile(r'^Status:[ \t]+(.+?)[ \t]*$', re.M) # ex. "Status:     INTEGER OPTIMAL"
+
 
 def main(argv):
     """
@@ -28,15 +43,32 @@ def main(argv):
 
     parser.add_argument('-l', '--latency', type=int, help="The desired latency to minimize memory under.")
     parser.add_argument('-a', '--area_cost', type=int, nargs='+', help="The desired area cost to minimize latency under. Input as a space seperated list of integers.")
-    parser.add_argument('-g', '--graph', type=argparse.FileType('r'), help="The desired DFG to automate the schedule for using ILP. It should be in edgelist format.")
+    parser.add_argument('-g', '--graph', type=str, help="The desired DFG to automate the schedule for using ILP. It should be in edgelist format.")
+    parser.add_argument('-s', '--solver', choices=['auto', 'glpsol', 'cbc', 'swiglpk'], default='auto', help="The ILP solver to run on the generated LP file. 'auto' uses cbc if it is on the PATH, otherwise glpsol. 'swiglpk' solves it in-process with the GLPK library.")
     args = parser.parse_args()
 
     # ensure user inserts a graph
     if args.graph is None:
         print("please insert an edgelist graph using -g")
         exit()
+    if not os.path.isfile(args.graph):
+        print(f"could not find the edgelist graph '{args.graph}'")
+        exit()
 
-    graph = nx.read_edgelist(args.graph, create_using=nx.DiGraph) # assumes first and last node are source and sink
+    # prefer CBC as it scales much better than GLPK on larger DFGs, but keep GLPK as the fallback
+    if args.solver == "auto":
+        args.solver = "cbc" if shutil.which("cbc") else "glpsol"
+    # check the optional swiglpk install once here, rather than in each solve of "both"
+    if args.solver == "swiglpk":
+        try:
+            import swiglpk
+        except ImportError:
+            print("please install 'swiglpk' to use the swiglpk solver")
+            exit()
+
+    # parse graph and get node units and costs in the same pass
+    names, edges, node_unit, unit_cost = parse_edgelist(args.graph)
+    dfg = DFG.from_edges(names, edges)
 
     # generate cases for which scheduling algorithm to use (MR-LC or ML-RC)
     if args.latency is None and args.area_cost is None:
@@ -48,31 +80,69 @@ def main(argv):
         schedule_obj = "MR-LC"
     elif args.latency and args.area_cost:
         schedule_obj = "both" 
+
+    # everything that doesn't depend on the objective is prepared once, and shared by both runs of "both"
+    print(f"schedule: {schedule_obj}")
+    prepared = prepare(dfg, node_unit, unit_cost, args)
     
     # run scheduler based on chosen objective
     if schedule_obj == "ML-RC" or schedule_obj == "MR-LC":
-        run_scheduler(schedule_obj, graph, args)
+        run_scheduler(schedule_obj, prepared, args)
     # TODO read/determine what pareto-optimal analysis using both results looks like
     elif schedule_obj == "both":
-        run_scheduler("ML-RC", graph, args)
-        run_scheduler("MR-LC", graph, args)
+        # write both ILP files first, then run the two independent solves at the same time
+        # threads are enough since glpsol and cbc run as their own processes
+        ilps = [build_ilp(obj, prepared, args) for obj in ("ML-RC", "MR-LC")]
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            solves = [pool.submit(run_solver, args.solver, lp_filename, integer_vars) for lp_filename, integer_vars, _ in ilps]
+        for obj, (_, _, crit_path_nodes), solve in zip(("ML-RC", "MR-LC"), ilps, solves):
+            print(f"schedule: {obj}") # label which objective each results table belongs to
+            show_results(obj, prepared, crit_path_nodes, solve.result())
     
 
-def run_scheduler(schedule_obj, graph, args):
+def run_scheduler(schedule_obj, prepared, args):
     '''
-        Runs the entire scheduler based on the given schedule objective (ML-RC or MR-LC), graph and args.
+        Runs the entire scheduler based on the given schedule objective (ML-RC or MR-LC), the ILPData from prepare and args.
+        Builds the ILP file, solves it and displays the results.
     '''
-    print(f"schedule: {schedule_obj}")
-    lp_filename = rf"auto_{schedule_obj}.lp" 
-    
-    # error check: make sure there is not a cycle
-    visited = rec_stack = dict.fromkeys(sorted(graph), False)
-    for node in graph.nodes():
-        if is_cyclic(graph, node, visited, rec_stack):
-            raise Exception('Invalid DFG, there is a cycle detected in the graph.')
-
-    # parse graph and get node units and costs
-    node_unit, unit_cost = get_node_unit_cost(graph)
+    lp_filename, integer_vars, crit_path_nodes = build_ilp(schedule_obj, prepared, args)
+
+    #TODO generate optimal pareto-analysis by checking difference of supplied constraints with iterative glpk runs
+
+    # run ILP solver and parse its output into a dict
+    min_results = run_solver(args.solver, lp_filename, integer_vars)
+    show_results(schedule_obj, prepared, crit_path_nodes, min_results)
+
+
+@dataclass
+class ILPData:
+    '''
+        Everything the ILP needs that is the same for any schedule objective, built once by prepare.
+    '''
+    nodes: list
+    node_unit: dict
+    units: tuple
+    unit_times_asap: dict
+    asap_times: array
+    alap_times: array
+    var_names: list
+    exec_lines: list
+    dep_lines: list
+
+
+def prepare(dfg, node_unit, unit_cost, args):
+    '''
+        Error checks the DFG and prepares the ILPData shared by every schedule objective,
+        given the DFG, node units and unit costs and args.
+    '''
+    source, sink = dfg.names[0], dfg.names[-1] # assumes first and last node are source and sink
+    # error check the DFG once, before any run, and get its topological order for ASAP and ALAP
+    order = validate_graph(dfg, dfg.node_id[source], dfg.node_id[sink])
+    nodes = get_nodes(dfg) # constraint order
+    # node ids used in the ILP variable names, the sink is always named 'n' so its variables stand out (ex. x_n_5)
+    var_ids = {node: id for id, node in enumerate(nodes)}
+    var_ids[sink] = 'n'
+
     print("node units:", node_unit)
     print(f"unit_costs: {unit_cost}")
 
@@ -81,49 +151,68 @@ def run_scheduler(schedule_obj, graph, args):
         raise Exception(f'Expected {len(unit_cost) - 2} area constraints but only {len(args.area_cost)} supplied.')
 
     # get the unit times for ASAP and ALAP
-    unit_times_asap = get_asap(graph)
+    unit_times_asap = get_asap(dfg, order, dfg.node_id[source])
 
-    t = list(graph.nodes())[-1] # sink node (assumes is the last node)
-    asap_latency_cstr = unit_times_asap[t] - 1 # the level before sink is the time of the last unit exec
+    asap_latency_cstr = unit_times_asap[sink] - 1 # the level before sink is the time of the last unit exec
     latency_cstr = args.latency if args.latency else asap_latency_cstr # either from user supplied latency constraint or ASAP
     if latency_cstr < asap_latency_cstr: # error check: make sure latency isn't too small
         raise Exception(f'Solution not posible, given latency constraint is too small. Should be at least {asap_latency_cstr}.')
-    unit_times_alap = get_alap(graph, latency_cstr)
+    unit_times_alap = get_alap(dfg, order, latency_cstr, dfg.node_id[sink])
     print("asap: ", unit_times_asap, "\nalap: ", unit_times_alap)
 
+    # dense copies of the times indexed by each node's position in 'nodes', for the constraint generators
+    asap_times = array('i', (unit_times_asap[node] for node in nodes))
+    alap_times = array('i', (unit_times_alap[node] for node in nodes))
+
+    # the variable names and the execution and dependency constraints only depend on the ASAP and ALAP times
+    var_names = get_var_names(nodes, var_ids, asap_times, alap_times)
+    return ILPData(
+        nodes=nodes,
+        node_unit=node_unit,
+        units=tuple(unit_cost.items())[1:-1], # (unit, cost) pairs without source and sink, shared by the generators
+        unit_times_asap=unit_times_asap,
+        asap_times=asap_times,
+        alap_times=alap_times,
+        var_names=var_names,
+        exec_lines=generate_exec_cstrs(var_names),
+        dep_lines=generate_dep_cstrs(dfg, nodes, var_names, asap_times, alap_times),
+    )
+
+
+def build_ilp(schedule_obj, prepared, args):
+    '''
+        Builds the ILP file for the given schedule objective (ML-RC or MR-LC) from the ILPData from prepare and args.
+        Returns the ILP file name, its integer variables and the critical path nodes.
+        \nex. ("auto_MR-LC.lp", {"a1", "a2", "a3", "a4"}, [])
+    '''
+    lp_filename = rf"auto_{schedule_obj}.lp" 
+    nodes, var_names, units = prepared.nodes, prepared.var_names, prepared.units
+    asap_times, alap_times = prepared.asap_times, prepared.alap_times
+
     ### generate ILP file, we can generate this line by line using the graph
-    # ex. generated_ilp = ["Minimize", "2a1 + 2a2 + 3a3 + 5a4", "Subject To", "e0: x01 = 1", "...", "Integer", "a1 a2 a3 a4", "End"]
-    generated_ilp = []
+    # each section is streamed to the file as soon as it is generated
+    # ex. "Minimize", "2 a1 + 2 a2 + 3 a3 + 5 a4", "Subject To", "e0: x01 = 1", "...", "Integer", "a1 a2 a3 a4", "End"
     integer_set = []
     crit_path_nodes = []
-    generated_ilp.append("Minimize")
-    generate_min_func(schedule_obj, graph, unit_times_asap, unit_times_alap, unit_cost, integer_set, crit_path_nodes, generated_ilp)
-    generated_ilp.append("Subject To")
-    generate_exec_cstrs(graph, unit_times_asap, unit_times_alap, generated_ilp)
-    generate_rsrc_cstrs(schedule_obj, graph, unit_cost, node_unit, args.area_cost, unit_times_asap, unit_times_alap, generated_ilp)
-    generate_dep_cstrs(graph, unit_times_asap, unit_times_alap, generated_ilp)
-    generate_closing(schedule_obj, integer_set, unit_cost, generated_ilp)
-    write_list(lp_filename, generated_ilp)
+    with open(lp_filename, 'w', buffering=1 << 20) as lp_file:
+        write_lines(lp_file, ["Minimize"])
+        write_lines(lp_file, generate_min_func(schedule_obj, nodes, var_names, asap_times, alap_times, units, integer_set, crit_path_nodes))
+        write_lines(lp_file, ["Subject To"])
+        write_lines(lp_file, prepared.exec_lines)
+        generate_rsrc_cstrs(lp_file, schedule_obj, nodes, var_names, units, prepared.node_unit, args.area_cost, asap_times, alap_times)
+        write_lines(lp_file, prepared.dep_lines)
+        closing_lines = generate_closing(schedule_obj, integer_set, units)
+        write_lines(lp_file, closing_lines)
 
-    #TODO generate optimal pareto-analysis by checking difference of supplied constraints with iterative glpk runs
+    integer_vars = set(closing_lines[1].split())
+    return lp_filename, integer_vars, crit_path_nodes
 
-    # run ILP solver (GLPK command) and output the text file
-    # ex. ./glpsol --cpxlp 'lp_filename'
-    glpsol_dir = r"../../glpk-4.35/examples/glpsol" # NOTE: assumes glpk dir is two directories up (same dir as the repo)
-    output_txt = f"{lp_filename[:-3]}.txt"
-    os.system(rf"{glpsol_dir} --cpxlp {lp_filename} -o {output_txt} >/dev/null 2>&1")
 
-    # parse the output and save it into a dict
-    min_results = {"obj": 0, "counts": {}}
-    with open(output_txt) as file:
-        for line in file:
-            line = line.split()
-            if line and line[0] == 'Objective:':
-                min_results["obj"] = line[3]
-            elif len(line) == 5 and line[2] == '*':
-                min_results["counts"][line[1]] = line[3]            
-    
-    # display the results nicely back to the user (QoR - Quality of Results)
+def show_results(schedule_obj, prepared, crit_path_nodes, min_results):
+    '''
+        Display the results from run_solver nicely back to the user (QoR - Quality of Results).
+    '''
+    nodes, unit_times_asap = prepared.nodes, prepared.unit_times_asap
     if schedule_obj == "ML-RC":
         data = []
         for node in crit_path_nodes: # show critical path nodes first
@@ -133,7 +222,7 @@ def run_scheduler(schedule_obj, graph, args):
                 unit = unit.split("_")
                 node_id = int(unit[1])
                 cycle = unit[2]
-                data.append([get_nodes(graph)[node_id], cycle])
+                data.append([nodes[node_id], cycle])
         min_latency = max([int(x[1]) for x in data])
         print(f"The minimized latency is {min_latency}.")
         print("Here is each node with its optimized cycle:")
@@ -145,311 +234,457 @@ def run_scheduler(schedule_obj, graph, args):
         print(tabulate(data, headers = ["Resource", "Min Count"]))
 
 
-def get_node_unit_cost(graph):
-    '''
-        Determine all the nodes and their associated units and costs.
-    '''
-    node_unit = {}
-    unit_cost = {}
-    for edge in graph.edges(data=True):
-        root = edge[0]
-        child = edge[1]
-        e_attr = edge[2]
-        root_unit = e_attr['root']
-        child_unit = e_attr['child']
-        root_cost = e_attr['root_cost']
-        child_cost = e_attr['child_cost']
-        node_unit[root] = root_unit
-        node_unit[child] = child_unit
-        unit_cost[root_unit] = root_cost
-        unit_cost[child_unit] = child_cost
-    node_unit = dict(sorted(node_unit.items()))
-    unit_cost = dict(sorted(unit_cost.items()))
-    return node_unit, unit_cost
-
-
-def is_cyclic(graph, node, visited, rec_stack):
+def run_solver(solver, lp_filename, integer_vars):
     '''
-        Checks if there is a cycle in the given graph.
-        Keeps track of visited nodes and ones on the recursive stack.
-        If a node is seen that is already in the recursive stack, then
-        that means there is a cycle.
+        Runs the given ILP solver (glpsol or cbc) on the LP file, which both read in CPLEX LP format,
+        launched directly without a shell, then parses the objective and the integer variables' values out of the solver's output text file.
+        With swiglpk the LP file is loaded and solved in-process through the GLPK library instead, so there
+        is no solver process to launch and no output text file to parse.
+        \nex. {"obj": "12", "counts": {"a1": "1", "a2": "1", "a3": "1", "a4": "1"}}
     '''
-    if rec_stack[node]: # if node was already seen in recursive stack
-        return True
-    if visited[node]: # node has already been seen
-        return False
-    visited[node] = rec_stack[node] = True
-
-    children = sorted(list(graph.adj[node]))
-    for child in children:
-        if is_cyclic(graph, child, visited, rec_stack):
-            return True
-            
-    rec_stack[node] = False # remove node from recursion stack before function ends
-    return False # no cycle exists
-
-
-def generate_min_func(schedule_obj, graph, unit_times_asap, unit_times_alap, unit_cost, integer_set, crit_path_nodes, generated_ilp, ml_var_letter='x', mr_var_letter='a'):
+    output_txt = f"{lp_filename[:-3]}.txt"
+    min_results = {"obj": 0, "counts": {}}
+    # remove the output left over from an earlier run, so a failed solve is never read as this one
+    if os.path.exists(output_txt):
+        os.remove(output_txt)
+    if solver == "glpsol":
+        # ex. ./glpsol --cpxlp 'lp_filename'
+        glpsol_dir = r"../../glpk-4.35/examples/glpsol" # NOTE: assumes glpk dir is two directories up (same dir as the repo)
+        solve = subprocess.run([glpsol_dir, "--cpxlp", lp_filename, "-o", output_txt], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if solve.returncode != 0 or not os.path.isfile(output_txt): # ex. glpsol could not parse the LP file
+            raise Exception(f'The glpsol solver could not solve the ILP file {lp_filename}.')
+        with open(output_txt) as file:
+            output = file.read()
+        # error check: make sure the solver found a schedule
+        status = GLPSOL_STATUS_RE.search(output)
+        if status is None or status.group(1) not in ("INTEGER OPTIMAL", "INTEGER FEASIBLE"):
+            raise Exception('Solution not posible, the ILP solver found no feasible schedule for the given constraints.')
+        for match in GLPSOL_OBJ_RE.finditer(output):
+            min_results["obj"] = match.group(1)
+        for match in GLPSOL_INT_COL_RE.finditer(output):
+            min_results["counts"][match.group(1)] = match.group(2)
+    elif solver == "cbc":
+        # ex. cbc 'lp_filename' solve solu 'output_txt'
+        # NOTE: assumes cbc is on the PATH
+        solve = subprocess.run(["cbc", lp_filename, "solve", "solu", output_txt], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if solve.returncode != 0 or not os.path.isfile(output_txt): # cbc exits cleanly on an unreadable LP file but writes no solution
+            raise Exception(f'The cbc solver could not solve the ILP file {lp_filename}.')
+        with open(output_txt) as file:
+            # error check: make sure the solver found a schedule, the header's first word is its status
+            header = file.readline().split() # ex. "Optimal - objective value 12.00000000" or "Infeasible - objective value 2.00000000"
+            if not header or header[0] != "Optimal":
+                raise Exception('Solution not posible, the ILP solver found no feasible schedule for the given constraints.')
+            min_results["obj"] = f"{float(header[-1]):g}"
+            for line in file:
+                line = line.split()
+                if len(line) == 4 and line[1] in integer_vars: # ex. "0 a1 1 2"
+                    min_results["counts"][line[1]] = str(round(float(line[2])))
+    elif solver == "swiglpk":
+        import swiglpk as glpk # already checked to be installed in main
+        glpk.glp_term_out(glpk.GLP_OFF) # quiet, like the other solvers' output sent to /dev/null
+        parm = glpk.glp_iocp()
+        glpk.glp_init_iocp(parm)
+        parm.presolve = glpk.GLP_ON # solve the LP relaxation as part of the MIP solve
+        prob = glpk.glp_create_prob()
+        try:
+            if glpk.glp_read_lp(prob, None, lp_filename) != 0:
+                raise Exception(f'Could not read the ILP file {lp_filename}.')
+            # error check: make sure the solver found a schedule, glp_intopt fails on an infeasible model when presolving
+            if glpk.glp_intopt(prob, parm) != 0 or glpk.glp_mip_status(prob) not in (glpk.GLP_OPT, glpk.GLP_FEAS):
+                raise Exception('Solution not posible, the ILP solver found no feasible schedule for the given constraints.')
+            min_results["obj"] = f"{glpk.glp_mip_obj_val(prob):g}"
+            for col in range(1, glpk.glp_get_num_cols(prob) + 1):
+                name = glpk.glp_get_col_name(prob, col)
+                if name in integer_vars:
+                    min_results["counts"][name] = str(round(glpk.glp_mip_col_val(prob, col)))
+        finally:
+            glpk.glp_delete_prob(prob)
+    return min_results
+
+
+def generate_min_func(schedule_obj, nodes, var_names, asap_times, alap_times, units, integer_set, crit_path_nodes, mr_var_letter='a'):
     '''
         Generates the minimize funciton part of an ILP file using 
-        the given unit costs and writes it to the given ilp list depending
+        the given (unit, cost) pairs and returns its lines depending
         on the schedule_obj.
-        \nML-RC ex. "  1x21 + 2x22 + 1x31 + 2x32 + 3x33 + 2x52 + 3x53 + 2x62 + 3x63 + 4x64 + 3x73 + 4x74
-        \nMR-LC ex. "  2a1 + 2a2 + 3a3 + 5a4"
+        Coefficients are separated from the variables by a space, which every CPLEX LP reader accepts.
+        \nML-RC ex. "  1 x21 + 2 x22 + 1 x31 + 2 x32 + 3 x33 + 2 x52 + 3 x53 + 2 x62 + 3 x63 + 4 x64 + 3 x73 + 4 x74
+        \nMR-LC ex. "  2 a1 + 2 a2 + 3 a3 + 5 a4"
     '''
-    s = list(graph.nodes())[0] # source node (assumes is the first node)
-    t = list(graph.nodes())[-1] # sink node (assumes is the last node)
+    s = nodes[0] # source node (assumes is the first node)
+    t = nodes[-1] # sink node (assumes is the last node)
     if schedule_obj == "ML-RC":
         min_func = []
-        nodes = get_nodes(graph)
-        for id, node in enumerate(nodes):
-            id = 'n' if node == t else id 
-            start_time = unit_times_asap[node]
-            end_time = unit_times_alap[node]
+        for i, node in enumerate(nodes):
+            start_time = asap_times[i]
+            end_time = alap_times[i]
             if start_time == end_time: # on critical path, redundant to include
                 if node != s and node != t: # ignore source and sink node
                     crit_path_nodes.append(node)
                 continue
             else:
-                for time in range(start_time, end_time + 1):
-                    min_func.append(f"{time}{ml_var_letter}_{id}_{time}")
-                    integer_set.append(f"{ml_var_letter}_{id}_{time}")
-        min_func = "  " + " + ".join(x for x in min_func)
-        generated_ilp.append(min_func)
-        return min_func
+                min_func.extend(f"{time} {name}" for time, name in zip(range(start_time, end_time + 1), var_names[i]))
+                integer_set.extend(var_names[i])
+        min_func = "  " + " + ".join(min_func)
+        return [min_func]
 
     elif schedule_obj == "MR-LC":
-        # ex. "  2a1 + 2a2 + 3a3 + 5a4"
-        min_func = [f"{cost}{mr_var_letter}{unit}" for unit, cost in list(unit_cost.items())[1:-1]] # ignore source and sink
-        min_func = "  " + " + ".join(x for x in min_func)
-        generated_ilp.append(min_func)
+        # ex. "  2 a1 + 2 a2 + 3 a3 + 5 a4"
+        min_func, _ = get_unit_lines(units, mr_var_letter)
+        return [min_func]
 
 
-def get_asap(graph):
+def parse_edgelist(path):
     '''
-        Get the ASAP unit times for the given graph.
-        \nex. {'s': 0, 'v1': 1, 'v4': 2, 'v7': 3, ...}
+        Parses the edgelist file at the given path directly into the node names (in order of first
+        appearance), a dict of edges to their attributes, and the nodes' units and the units' costs
+        (both sorted), all in one pass without going through nx.read_edgelist.
+        The file is memory mapped and split as bytes, only the node names and attribute dicts are decoded.
+        Follows the same format: "root child {attr dict}" per line, '#' starts a comment.
+        \nex. (['s', 'v1', ...], {('s', 'v1'): {'root': 0, 'child': 3, 'root_cost': 0, 'child_cost': 3}, ...},
+        {'s': 0, 't': 5, 'v1': 3, ...}, {0: 0, 1: 2, 2: 2, 3: 3, ...})
     '''
-    unit_times_asap = {}
-    seen = set()
+    names = {}
+    edges = {}
+    node_unit = {}
+    unit_cost = {}
+    if os.path.getsize(path) == 0: # mmap can't map an empty file
+        return [], edges, node_unit, unit_cost
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in iter(mm.readline, b''):
+            line = line.split(b'#', 1)[0].split(maxsplit=2)
+            if len(line) < 2: # blank or a lone node name, skipped like nx.read_edgelist does
+                continue
+            root, child = line[0].decode(), line[1].decode()
+            e_attr = ast.literal_eval(line[2].decode()) if len(line) == 3 else {}
+            names.setdefault(root)
+            names.setdefault(child)
+            edges.setdefault((root, child), {}).update(e_attr)
+            node_unit[root] = e_attr['root']
+            node_unit[child] = e_attr['child']
+            unit_cost[e_attr['root']] = e_attr['root_cost']
+            unit_cost[e_attr['child']] = e_attr['child_cost']
+    node_unit = dict(sorted(node_unit.items()))
+    unit_cost = dict(sorted(unit_cost.items()))
+    return list(names), edges, node_unit, unit_cost
 
-    level = 0
-    s = list(graph.nodes())[0] # source node (assumes is first node)
-    unit_times_asap[s] = level
-    seen.add(s)
 
-    children = sorted(list(graph.adj[s]))
-    if not children:
+@dataclass
+class DFG:
+    '''
+        Lean snapshot of the DFG used by the scheduling passes: the node names, their integer ids
+        and the successor/predecessor lists packed as compressed sparse row (CSR) arrays, so they can
+        be indexed without going through the networkx views on every visit.
+        Node ids follow the node order, so source is id 0 and sink is the last id.
+        Each node's parents are sorted by name once here, in the order the dependency constraints use them.
+        \nex. children of node i are out_indices[out_indptr[i]:out_indptr[i + 1]]
+    '''
+    names: list
+    node_id: dict
+    out_indptr: array
+    out_indices: array
+    in_indptr: array
+    in_indices: array
+
+    @classmethod
+    def from_edges(cls, names, edges):
+        '''
+            Builds the DFG from the node names and (root, child) edges given by parse_edgelist.
+        '''
+        node_id = {node: id for id, node in enumerate(names)}
+        children = [array('i') for _ in names]
+        parents = [array('i') for _ in names]
+        for root, child in edges:
+            children[node_id[root]].append(node_id[child])
+            parents[node_id[child]].append(node_id[root])
+
+        out_indptr, out_indices = array('i', [0]), array('i')
+        in_indptr, in_indices = array('i', [0]), array('i')
+        for id in range(len(names)):
+            out_indices.extend(children[id])
+            out_indptr.append(len(out_indices))
+            in_indices.extend(sorted(parents[id], key=names.__getitem__))
+            in_indptr.append(len(in_indices))
+        return cls(names, node_id, out_indptr, out_indices, in_indptr, in_indices)
+
+    def children(self, id):
+        '''
+            Ids of the children of the node with the given id.
+        '''
+        return self.out_indices[self.out_indptr[id]:self.out_indptr[id + 1]]
+
+    def parents(self, id):
+        '''
+            Ids of the parents of the node with the given id.
+        '''
+        return self.in_indices[self.in_indptr[id]:self.in_indptr[id + 1]]
+
+
+def validate_graph(dfg, s, t):
+    '''
+        Error checks the structure of the DFG once, before scheduling: there is no cycle, the source
+        has children and the sink has parents. 's' and 't' are the ids of the source and sink nodes.
+        Returns the topological order from get_topological_order, which is also the cycle check.
+    '''
+    # error check: make sure there is not a cycle, done while ordering the nodes for ASAP and ALAP
+    order = get_topological_order(dfg)
+    if not dfg.children(s):
         raise Exception('Invalid DFG, there are no children connected to source.')
-    for child in children:
-        dfs(graph, child, unit_times_asap, seen, level)
+    if not dfg.parents(t):
+        raise Exception('Invalid DFG, there are no parents connected to sink.')
+    return order
 
-    # error check: make sure all the nodes have been seen from source
-    if len(graph.nodes()) != len(seen):
-        raise Exception('Invalid DFG, there is at least one node that is untraversable from source.')
-    
+
+def get_topological_order(dfg):
+    '''
+        Orders the node ids of the DFG topologically using Kahn's algorithm.
+        Any node left unordered at the end is on a cycle, so this is also the cycle check.
+        \nex. array('i', [0, 1, 2, 3, 4, ...])
+    '''
+    indptr, indices = dfg.out_indptr, dfg.out_indices
+    in_indptr = dfg.in_indptr
+    num_nodes = len(dfg.names)
+    in_degree = array('i', (in_indptr[v + 1] - in_indptr[v] for v in range(num_nodes)))
+
+    order = array('i', (v for v in range(num_nodes) if in_degree[v] == 0))
+    processed = 0
+    while processed < len(order):
+        v = order[processed]
+        processed += 1
+        for k in range(indptr[v], indptr[v + 1]):
+            in_degree[indices[k]] -= 1
+            if in_degree[indices[k]] == 0:
+                order.append(indices[k])
+
+    if processed != num_nodes:
+        raise Exception('Invalid DFG, there is a cycle detected in the graph.')
+    return order
+
+
+def get_asap(dfg, order, s):
+    '''
+        Get the ASAP unit times for the given DFG.
+        Walks the nodes once in the given topological order so each node's time is one more
+        than the latest of its parents. 's' is the id of the source node.
+        \nex. {'s': 0, 'v1': 1, 'v2': 1, 'v3': 1, ...}
+    '''
+    names = dfg.names
+    times = array('i', [0]) * len(names)
+
+    asap_csr(dfg.in_indptr, dfg.in_indices, order, times)
+
+    # translate back to names and error check in the same pass
+    unit_times_asap = {}
+    for v in order:
+        if times[v] == 0 and v != s: # error check: make sure all the nodes can be reached from source
+            raise Exception('Invalid DFG, there is at least one node that is untraversable from source.')
+        unit_times_asap[names[v]] = times[v]
     return unit_times_asap
 
 
-def dfs(graph, node, unit_times, seen, level):
+def asap_csr(in_indptr, in_indices, order, out):
     '''
-        Does a depth first search for the given graph and determines the time a node/unit executes.
-        Recursively calls itself and keeps track of the node level. Updates the 'unit_times'
-        dict and 'seen' set.
+        Longest path kernel for ASAP over the CSR predecessor arrays.
+        Fills 'out' in the given topological order, a node with no parents gets time 0.
     '''
-    level += 1
-    n_level = unit_times.get(node, -1)
-    if level > n_level:
-        unit_times[node] = level
-    seen.add(node)
-    children = sorted(list(graph.adj[node]))
-    for child in children:
-        dfs(graph, child, unit_times, seen, level)
+    for v in order:
+        level = -1
+        for k in range(in_indptr[v], in_indptr[v + 1]):
+            if out[in_indices[k]] > level:
+                level = out[in_indices[k]]
+        out[v] = level + 1
 
 
-def get_alap(graph, latency_cstr):
+def get_alap(dfg, order, latency_cstr, t):
     '''
-        Get the ALAP unit times for the given graph.
-        \nex. {'t': 5, 'v6': 4, 'v3': 3, 's': 0, ...}
+        Get the ALAP unit times for the given DFG.
+        Walks the nodes once in the reverse of the given topological order so each node's time is one less
+        than the earliest of its children. 't' is the id of the sink node.
+        \nex. {'t': 5, 'v9': 4, 'v7': 4, ...}
     '''
-    unit_times_alap = {}
-    seen = set()
-
-    level = latency_cstr + 1 # sink node is one level above
-    t = list(graph.nodes())[-1] # sink node
-    unit_times_alap[t] = level
-    seen.add(t)
+    names = dfg.names
+    times = array('i', [0]) * len(names)
 
-    parents = sorted(list(graph.predecessors(t)))
-    if not parents:
-        raise Exception('Invalid DFG, there are no parents connected to sink.')
-    for parent in parents:
-        dfs_reverse(graph, parent, unit_times_alap, seen, level)
+    sink_level = latency_cstr + 1 # sink node is one level above
 
-    # error check: make sure all the nodes have been seen sink
-    if len(graph.nodes()) != len(seen):
-        raise Exception('Invalid DFG, there is at least one node that is untraversable from sink.')
+    alap_csr(dfg.out_indptr, dfg.out_indices, order, times, sink_level)
 
+    # translate back to names and error check in the same pass
+    unit_times_alap = {}
+    for v in reversed(order):
+        if times[v] == sink_level and v != t: # error check: make sure all the nodes can be reached from sink
+            raise Exception('Invalid DFG, there is at least one node that is untraversable from sink.')
+        unit_times_alap[names[v]] = times[v]
     return unit_times_alap
 
 
-def dfs_reverse(graph, node, unit_times, seen, level):
+def alap_csr(out_indptr, out_indices, order, out, sink_level):
     '''
-        Does a depth first search for the given graph and determines the time a node/unit executes.
-        Recursively calls itself and keeps track of the node level. Updates the 'unit_times'
-        dict and 'seen' set.
+        Longest path kernel for ALAP over the CSR successor arrays.
+        Fills 'out' in reverse of the given topological order, a node with no children gets 'sink_level'.
     '''
-    level -= 1
-    n_level = unit_times.get(node, float('inf'))
-    if level < n_level:
-        unit_times[node] = level
-    seen.add(node)
-    parents = sorted(list(graph.predecessors(node)))
-    for parent in parents:
-        dfs_reverse(graph, parent, unit_times, seen, level)
+    for v in reversed(order):
+        level = sink_level + 1
+        for k in range(out_indptr[v], out_indptr[v + 1]):
+            if out[out_indices[k]] < level:
+                level = out[out_indices[k]]
+        out[v] = level - 1
 
 
-def generate_exec_cstrs(graph, unit_times_asap, unit_times_alap, generated_ilp, var_letter='x', cstr_var_letter='e'):
+def get_var_names(nodes, var_ids, asap_times, alap_times, var_letter='x'):
+    '''
+        Builds the table of each node's variable names over its execution window.
+        The ILP generators all take the nodes in the order returned by get_nodes, and their ASAP and ALAP times
+        (and this table) are indexed by each node's position in that order. The table is then indexed by the time
+        minus the node's ASAP time, so each name is only formatted once and every generator reuses the same strings.
+        \nex. [['x_0_0'], ['x_1_1', 'x_1_2'], ['x_2_1', 'x_2_2', 'x_2_3'], ...]
+    '''
+    return [
+        [f"{var_letter}_{var_ids[node]}_{time}" for time in range(asap_times[i], alap_times[i] + 1)]
+        for i, node in enumerate(nodes)
+    ]
+
+
+def generate_exec_cstrs(var_names, cstr_var_letter='e'):
     '''
         Generate execution constraints for both ml-rc and mr-lc graphs.
         \nex. "  e0: x01 = 1" or "  e3: x31 + x32 + x33 = 1"
     '''
-    cstr_id = 0
-    nodes = get_nodes(graph)
-    for id, node in enumerate(nodes):
-        id = 'n' if node == 't' else id
-        start_time = unit_times_asap[node]
-        end_time = unit_times_alap[node]
-        exec_cstr = []
-        for time in range(start_time, end_time + 1):
-            exec_cstr.append(f"{var_letter}_{id}_{time}")
-
-        # ex. "  e0: x01 = 1" or "  e3: x31 + x32 + x33 = 1"
-        exec_cstr = " + ".join(x for x in exec_cstr)
-        line = f"  {cstr_var_letter}{cstr_id}: {exec_cstr} = 1"
-        generated_ilp.append(line)
-        cstr_id += 1
+    # one constraint per node, each a single join over the node's precomputed variable names
+    # ex. "  e0: x01 = 1" or "  e3: x31 + x32 + x33 = 1"
+    return [f"  {cstr_var_letter}{cstr_id}: " + " + ".join(names) + " = 1" for cstr_id, names in enumerate(var_names)]
 
 
-def get_nodes(graph):
+def get_nodes(dfg):
     '''
-        Sort the nodes then remove/reinsert the source and sink (assumed to be first and last node). 
-        Useful so that constraints can be added in the correct order.
+        Sort the nodes with the source and sink (assumed to be first and last node) kept at the ends. 
+        Useful so that constraints can be added in the correct order, computed once in prepare and shared by the generators.
     '''
-    s = list(graph.nodes())[0] # source node (assumes is the first node)
-    t = list(graph.nodes())[-1] # sink node (assumes is the last node)
-    nodes = sorted(list(graph.nodes()))
-    nodes.remove(s)
-    nodes.remove(t)
-    nodes.insert(0, s)
-    nodes.append(t)
-    return nodes
+    s = dfg.names[0] # source node (assumes is the first node)
+    t = dfg.names[-1] # sink node (assumes is the last node)
+    return [s] + sorted(n for n in dfg.names if n != s and n != t) + [t]
 
 
-def generate_rsrc_cstrs(schedule_obj, graph, unit_cost, node_unit, unit_count, unit_times_asap, unit_times_alap, generated_ilp, var_letter='x', cstr_var_letter='r', rsrc_var_letter='a'):
+def generate_rsrc_cstrs(out, schedule_obj, nodes, var_names, units, node_unit, unit_count, asap_times, alap_times, cstr_var_letter='r', rsrc_var_letter='a'):
     '''
         Generate resource constraints for both ml-rc and mr-lc graphs.
+        Each line is written to the open file 'out' as soon as it is built, since these are not shared between runs.
         \nex. "  r0: x42 - a1 <= 0" or "  r3: x11 + x21 - a3 <= 0"
     '''
     cstr_id = 0
-    nodes = get_nodes(graph)
-    for unit, _ in list(unit_cost.items())[1:-1]:# ignore source and sink
-        nodes_unit = [n for n, u in node_unit.items() if unit == u]
+    # positions of the nodes of each unit, bucketed in one pass over the nodes
+    by_unit = defaultdict(list)
+    for i, node in enumerate(nodes):
+        by_unit[node_unit[node]].append(i)
+    num_times = alap_times[-1] # loop to latency constraint (sink is the last node)
+    for unit, _ in units:
+        nodes_unit = by_unit[unit]
         if schedule_obj == "ML-RC":
             subtrahend = unit_count[unit - 1]
         elif schedule_obj == "MR-LC":
             subtrahend = f"{rsrc_var_letter}{unit}"
-        for time in range(1, unit_times_alap['t']): # loop to latency constraint
-            rsrc_cstr = []
-            for node in nodes_unit:
-                start_time = unit_times_asap[node]
-                end_time = unit_times_alap[node]
-                if time >= start_time and time <= end_time:
-                    rsrc_cstr.append(f"{var_letter}_{nodes.index(node)}_{time}")
+
+        # bucket each node's variables by the times it can execute at, so every time slot
+        # gets its active nodes without testing every node against every time
+        active = [[] for _ in range(num_times)]
+        for i in nodes_unit:
+            names, start_time = var_names[i], asap_times[i]
+            for time in range(max(start_time, 1), min(alap_times[i] + 1, num_times)):
+                active[time].append(names[time - start_time])
+
+        for rsrc_cstr in active[1:]:
             if rsrc_cstr:
                 # ex. "  r0: x42 - a1 <= 0" or "  r3: x11 + x21 - a3 <= 0"
-                rsrc_cstr = " + ".join(x for x in rsrc_cstr)
+                rsrc_cstr = " + ".join(rsrc_cstr)
                 if schedule_obj == "MR-LC":
                     line = f"  {cstr_var_letter}{cstr_id}: {rsrc_cstr} - {subtrahend} <= 0"
                 if schedule_obj == "ML-RC":
                     line = f"  {cstr_var_letter}{cstr_id}: {rsrc_cstr} <= {subtrahend}"
-                generated_ilp.append(line)
+                out.write(line + "\n")
                 cstr_id += 1
 
 
-def generate_dep_cstrs(graph, unit_times_asap, unit_times_alap, generated_ilp, var_letter='x', cstr_var_letter='d'):
+def generate_dep_cstrs(dfg, nodes, var_names, asap_times, alap_times, cstr_var_letter='d'):
     '''
         Generate dependency constraints for both ml-rc and mr-lc graphs.
-        \nex. "  d0: 3x53 + 2x52 - 2x22 - 1x21 >= 1"
+        \nex. "  d0: 3 x53 + 2 x52 - 2 x22 - 1 x21 >= 1"
     '''
     # add all the node constraints
+    dep_lines = []
     cstr_id = 0
-    nodes = get_nodes(graph)
-    for id, node in enumerate(nodes):
-        id = 'n' if node == 't' else id
+    s = nodes[0] # source node (assumes is the first)
+    index = {node: i for i, node in enumerate(nodes)} # position of each node in the time arrays
+    slacks = array('i', [0]) * len(nodes) # node slacks indexed by DFG node id, to check the parents without their names
+    for i, node in enumerate(nodes):
+        slacks[dfg.node_id[node]] = alap_times[i] - asap_times[i]
 
-        parents = sorted(list(graph.predecessors(node)))
-        s = nodes[0] # source node (assumes is the first)
-        if not parents or parents[0] == s: # source dependencies are implicit from execution constraints
-            continue
-        
+    for i, node in enumerate(nodes):
         # compute node slack
-        start_time = unit_times_asap[node]
-        end_time = unit_times_alap[node]
+        start_time = asap_times[i]
+        end_time = alap_times[i]
         slack = end_time - start_time
 
+        parent_ids = dfg.parents(dfg.node_id[node])
+        if not slack and not any(slacks[p] for p in parent_ids): # node and all its parents on critical path, nothing to add
+            continue
+        parents = [dfg.names[p] for p in parent_ids] # already sorted by name
+        if not parents or parents[0] == s: # source dependencies are implicit from execution constraints
+            continue
+
+        # node exec times, the same for every parent
+        plus_terms = " + ".join(f"{time} {name}" for time, name in zip(range(start_time, end_time + 1), var_names[i]))
+
         # compute parent slacks
         for parent in parents:
-            parent_start_time = unit_times_asap[parent]
-            parent_end_time = unit_times_alap[parent]
+            p = index[parent]
+            parent_start_time = asap_times[p]
+            parent_end_time = alap_times[p]
             parent_slack = parent_end_time - parent_start_time
 
             if slack or parent_slack: # dependencies on critical path are implicit from execution constraints
                 # parent exec times
-                dep_cstr = []
-                for time in range(start_time, end_time + 1):
-                    dep_cstr.append(f"{time}{var_letter}_{id}_{time}")
-                plus_count = len(dep_cstr) - 1
+                minus_terms = " - ".join(f"{time} {name}" for time, name in zip(range(parent_start_time, parent_end_time + 1), var_names[p]))
 
-                # parent exec times
-                for time in range(parent_start_time, parent_end_time + 1):
-                    parent_id = nodes.index(parent)
-                    dep_cstr.append(f"{time}{var_letter}_{parent_id}_{time}") 
-                
-                # ex. "  d0: 3x53 + 2x52 - 2x22 - 1x21 >= 1"
-                dep_cstr = " - ".join(x for x in dep_cstr)
-                dep_cstr = dep_cstr.replace('-', '+', plus_count)
-                line = f"  {cstr_var_letter}{cstr_id}: {dep_cstr} >= 1"
-                generated_ilp.append(line)
+                # ex. "  d0: 3 x53 + 2 x52 - 2 x22 - 1 x21 >= 1"
+                line = f"  {cstr_var_letter}{cstr_id}: {plus_terms} - {minus_terms} >= 1"
+                dep_lines.append(line)
                 cstr_id += 1
-    
+    return dep_lines
 
-def generate_closing(schedule_obj, integer_set, unit_cost, generated_ilp, var_letter='a'):
+
+def generate_closing(schedule_obj, integer_set, units, var_letter='a'):
     '''
-        Generates the closing part of an ILP file, which depends on the number of units.
+        Generates the closing part of an ILP file, which depends on the given (unit, cost) pairs.
         \nex. "Integer\n  a1 a2 a3 a4\nEnd"
     '''
     if schedule_obj == "ML-RC":
-        generated_ilp.append("Integer")
-        integer_set = "  " + " ".join(x for x in integer_set)
-        generated_ilp.append(integer_set)
-        generated_ilp.append("End")
+        integer_set = "  " + " ".join(integer_set)
+        return ["Integer", integer_set, "End"]
     elif schedule_obj == "MR-LC":
-        generated_ilp.append("Integer")
-        closing = [f"{var_letter}{unit}" for unit, _ in list(unit_cost.items())[1:-1]] # ignore source and sink
-        closing = "  " + " ".join(x for x in closing)
-        generated_ilp.append(closing)
-        generated_ilp.append("End")
+        _, closing = get_unit_lines(units, var_letter)
+        return ["Integer", closing, "End"]
+
+
+@functools.lru_cache(maxsize=8)
+def get_unit_lines(units, var_letter='a'):
+    '''
+        Builds the MR-LC minimize and integer lines from the given (unit, cost) pairs, without source and sink.
+        These only depend on the units of the DFG and not on the latency constraint, so they
+        are cached and reused when the same DFG is solved again.
+        \nex. ("  2 a1 + 2 a2 + 3 a3 + 5 a4", "  a1 a2 a3 a4")
+    '''
+    min_func = "  " + " + ".join(f"{cost} {var_letter}{unit}" for unit, cost in units)
+    closing = "  " + " ".join(f"{var_letter}{unit}" for unit, _ in units)
+    return min_func, closing
 
 
-def write_list(filename, list_strings):
+def write_lines(f, list_strings):
     '''
-       Takes a list of strings and writes them to a file line by line. 
+       Takes a list of strings and writes them to the given open file line by line, using one write call.
     '''
-    with open(filename, 'w') as f:
-        for s in list_strings:
-            f.write("%s\n" % s)
+    if list_strings:
+        f.write("\n".join(list_strings) + "\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+python ../src/scheduler.py -g test.edgelist -l 4 -a 1 2 3 4 -s cbc